@@ -3,12 +3,18 @@
 Convert US keyboard layout key names to JIS keyboard layout aliases in a ZMK keymap.
 
 Usage:
-    python convert_us_to_jis.py input.keymap
+    python convert_us_to_jis.py input.keymap [more.keymap ...]
 
-This will:
+This will, for each file:
     - Backup original file to input.keymap_original
     - Convert and save to input.keymap (overwrite)
 
+Line endings are written back as they were read, on every platform, so a CRLF
+keymap stays CRLF (the original script turned it into LF on POSIX). Only lone-CR
+line breaks become LF. The header takes the line ending of the first line.
+A file that cannot be read, backed up or written is reported and skipped; the
+remaining files are still converted and the exit status is 1.
+
 What is converted:
     - Only selected bindings where the "keycode argument" position is clear.
       Default targets (from your keymap):
@@ -20,17 +26,22 @@ What is converted:
 Notes:
     - This script does NOT convert inside modifier wrappers like LS(TAB), LC(LA(KEY)), etc.
     - It only converts bare key tokens that match the conversion table.
+    - The module is fully annotated and can be compiled with mypyc for speed
+      (mypyc convert_us_to_jis.py); importing it then loads the compiled module.
 """
 
+import functools
+import os
 import re
+import stat
 import sys
-import shutil
+import tempfile
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, Final, FrozenSet, List, Pattern, Tuple, Union, overload
 
 # Conversion table: (JP_define_name, [US_key_names], define_value, symbol_comment)
 # Multiple US key name variations are supported in the list
-CONVERSION_TABLE: List[Tuple[str, List[str], str, str]] = [
+CONVERSION_TABLE: Final[List[Tuple[str, List[str], str, str]]] = [
     ("JP_DQUOTE", ["DOUBLE_QUOTES", "DOUBLE_QUOTE", "DQT"], "AT", '"'),
     ("JP_AMPERSAND", ["AMPERSAND", "AMPS", "AMP"], "CARET", "&"),
     ("JP_QUOTE", ["SINGLE_QUOTE", "SQT", "APOS"], "AMPERSAND", "'"),
@@ -58,28 +69,63 @@ CONVERSION_TABLE: List[Tuple[str, List[str], str, str]] = [
 
 # Binding -> which arg is the "key name" to convert
 # 0-based index, -1 means last argument
-BINDING_KEY_ARG_RULES: Dict[str, int] = {
+BINDING_KEY_ARG_RULES: Final[Dict[str, int]] = {
     "kp": 0,
     "mt": -1,
     "lt": -1,
     "lt_to_layer_0": -1,
 }
 
-
-def generate_define_header() -> str:
-    """Generate #define header for JIS layout"""
-    lines = [
+# Keymaps at least this large (in bytes of UTF-8) are converted on all CPUs,
+# provided there are at least PARALLEL_MIN_WORKERS of them. Measured on one CPU,
+# the serial pass runs at about 120 MB/s (8.2 ms/MB), while the pool costs about
+# 10 ms to start plus 5.4 ms/MB to ship chunks out and back. That estimates
+# 10 ms + (5.4 + 8.2/N) ms/MB for N workers: no gain below four workers, and at
+# this threshold with four only about 2 ms out of about 130 ms. The speedup on
+# real concurrent workers has not been measured.
+PARALLEL_MIN_CHARS: Final[int] = 16 << 20
+PARALLEL_MIN_WORKERS: Final[int] = 4
+
+# Match: &<binding> <args...>
+# - binding: letters/digits/underscore, starting with letter/underscore
+# - args: stop before common list/DT terminators (comma, ;, >, newline)
+# Neither part crosses a newline, so the pattern can run over a whole file.
+# The patterns run over UTF-8 bytes, where \s is ASCII only, so the remaining
+# characters that str.split() treats as whitespace are spelled out as UTF-8.
+_UNICODE_SPACE: Final[str] = (
+    r'[\x1c-\x1f]|\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]'
+    r'|\xe2\x81\x9f|\xe3\x80\x80'
+)
+_SPACE: Final[str] = rf'(?:[^\S\n]|{_UNICODE_SPACE})'
+_ARG: Final[str] = rf'(?:[^\s,;>\x1c-\x1f\xc2\xe1-\xe3]|(?!{_UNICODE_SPACE})[\xc2\xe1-\xe3])+'
+_ANY_BINDING_PATTERN: Final[str] = rf'[a-zA-Z_][a-zA-Z0-9_]*{_SPACE}+[^,;>\n]+'
+
+
+# The header only depends on CONVERSION_TABLE, so it is built once at import.
+# "{jp_name:<19} " pads to column 20 while always keeping at least one space.
+_DEFINE_HEADER: Final[str] = "\n".join(
+    [
         "// ========================================",
         "// JIS Keyboard Layout Definitions",
         "// ========================================",
+        *(
+            f"#define {jp_name:<19} {us_value:<20}// {comment}"
+            for jp_name, _, us_value, comment in CONVERSION_TABLE
+        ),
+        "",  # blank line
     ]
+)
+_DEFINE_HEADER_BYTES: Final[bytes] = _DEFINE_HEADER.encode("utf-8")
+
+
+def generate_define_header() -> str:
+    """Generate #define header for JIS layout"""
+    return _DEFINE_HEADER
 
-    for jp_name, _, us_value, comment in CONVERSION_TABLE:
-        padding = " " * max(1, (20 - len(jp_name)))
-        lines.append(f"#define {jp_name}{padding}{us_value:<20}// {comment}")
 
-    lines.append("")  # blank line
-    return "\n".join(lines)
+def generate_define_header_bytes() -> bytes:
+    """Generate #define header for JIS layout, UTF-8 encoded"""
+    return _DEFINE_HEADER_BYTES
 
 
 def create_conversion_map() -> Dict[str, str]:
@@ -91,6 +137,77 @@ def create_conversion_map() -> Dict[str, str]:
     return conversion_map
 
 
+_CompiledBindings = Tuple[Pattern[bytes], Dict[bytes, bytes]]
+
+
+@functools.lru_cache(maxsize=8)
+def _compile_binding_re(
+    conversion_items: FrozenSet[Tuple[str, str]],
+) -> _CompiledBindings:
+    """
+    Compile the binding pattern for a set of (US name, JP name) conversions.
+
+    Conversion works on UTF-8 bytes, so both the pattern and the returned
+    US -> JP map are bytes.
+
+    Each BINDING_KEY_ARG_RULES index gets its own branch, which only matches when
+    the argument at that index is a convertible US name and captures it as the
+    sole group of the branch. Any other binding falls through to a catch-all
+    branch that captures nothing, so every match spans exactly what the generic
+    &<binding> <args...> pattern would.
+    """
+    conversions = sorted(
+        (
+            item
+            for item in conversion_items
+            if re.fullmatch(_ARG.encode("utf-8"), item[0].encode("utf-8"))
+        ),
+        key=lambda item: (-len(item[0]), item[0]),
+    )
+    if conversions:
+        key = "(" + "|".join(re.escape(us_name) for us_name, _ in conversions) + ")"
+    else:
+        key = "(?!)"
+
+    bindings_by_index: Dict[int, List[str]] = {}
+    for binding, key_arg_index in BINDING_KEY_ARG_RULES.items():
+        bindings_by_index.setdefault(key_arg_index, []).append(binding)
+
+    branches: List[str] = []
+    for key_arg_index, bindings in bindings_by_index.items():
+        binding = "(?:" + "|".join(map(re.escape, bindings)) + ")" + _SPACE + "+"
+        if key_arg_index >= 0:
+            before = f"(?:{_ARG}{_SPACE}+){{{key_arg_index}}}"
+            after = rf"(?=[\s,;>]|{_UNICODE_SPACE}|\Z)[^,;>\n]*"
+        else:
+            before = f"(?:[^,;>\\n]*{_SPACE})?"
+            after = f"(?:{_SPACE}+{_ARG}){{{-key_arg_index - 1}}}{_SPACE}*(?=[,;>\\n]|\\Z)"
+        branches.append(binding + before + key + after)
+    branches.append(_ANY_BINDING_PATTERN)
+
+    pattern = "&(?:" + "|".join(branches) + ")"
+    return (
+        re.compile(pattern.encode("utf-8")),
+        {us.encode("utf-8"): jp.encode("utf-8") for us, jp in conversions},
+    )
+
+
+# The default map never changes, so its pattern is compiled once at import
+_DEFAULT_CONVERSION_MAP: Final[Dict[str, str]] = create_conversion_map()
+_DEFAULT_BINDINGS: Final[_CompiledBindings] = _compile_binding_re(
+    frozenset(_DEFAULT_CONVERSION_MAP.items())
+)
+
+
+def _resolve_binding_re(conversion_map: Dict[str, str]) -> _CompiledBindings:
+    """Return the compiled bindings for conversion_map"""
+    # A dict comparison is much cheaper than building the frozenset cache key,
+    # and nearly every caller passes the default map
+    if conversion_map == _DEFAULT_CONVERSION_MAP:
+        return _DEFAULT_BINDINGS
+    return _compile_binding_re(frozenset(conversion_map.items()))
+
+
 def convert_keymap_line(line: str, conversion_map: Dict[str, str]) -> str:
     """
     Convert key names in a single line.
@@ -98,99 +215,273 @@ def convert_keymap_line(line: str, conversion_map: Dict[str, str]) -> str:
     Converts only for bindings listed in BINDING_KEY_ARG_RULES and only for the
     designated argument index (e.g. last arg for mt/lt).
     """
+    binding_re, jp_by_us = _resolve_binding_re(conversion_map)
+    data = line.encode("utf-8", "surrogatepass")
+    converted_data = _convert_keymap_text_serial(data, binding_re, jp_by_us)[0]
+    return converted_data.decode("utf-8", "surrogatepass")
 
-    # Match: &<binding> <args...>
-    # - binding: letters/digits/underscore, starting with letter/underscore
-    # - args: stop before common list/DT terminators (comma, ;, >, newline)
-    pattern = r'&([a-zA-Z_][a-zA-Z0-9_]*)\s+([^,;>\n]+)'
-
-    def repl(m: re.Match) -> str:
-        binding = m.group(1)
-        args_str = m.group(2)
-
-        if binding not in BINDING_KEY_ARG_RULES:
-            return m.group(0)
 
-        args = args_str.split()
-        if not args:
-            return m.group(0)
+@overload
+def convert_keymap_text(text: str, conversion_map: Dict[str, str]) -> Tuple[str, int]: ...
+@overload
+def convert_keymap_text(text: bytes, conversion_map: Dict[str, str]) -> Tuple[bytes, int]: ...
 
-        key_arg_index = BINDING_KEY_ARG_RULES[binding]
-        idx = key_arg_index if key_arg_index >= 0 else (len(args) + key_arg_index)
 
-        if idx < 0 or idx >= len(args):
-            return m.group(0)
-
-        key_name = args[idx]
-        if key_name in conversion_map:
-            args[idx] = conversion_map[key_name]
-
-        return f"&{binding} " + " ".join(args)
+def convert_keymap_text(
+    text: Union[str, bytes], conversion_map: Dict[str, str]
+) -> Tuple[Union[str, bytes], int]:
+    """
+    Convert key names in a whole keymap, given as str or as UTF-8 bytes.
 
-    return re.sub(pattern, repl, line)
+    Returns the converted text and the number of lines that changed. Buffers of
+    at least PARALLEL_MIN_CHARS are split on line boundaries and converted on all
+    CPUs when there are PARALLEL_MIN_WORKERS or more; anything else is done in
+    one regex pass.
+    """
+    if isinstance(text, str):
+        data, count = convert_keymap_text(text.encode("utf-8", "surrogatepass"), conversion_map)
+        return data.decode("utf-8", "surrogatepass"), count
+
+    # Every binding starts with '&', so one memchr-backed scan settles inputs
+    # without any binding before the regex is even looked up
+    if b"&" not in text:
+        return text, 0
+    binding_re, jp_by_us = _resolve_binding_re(conversion_map)
+
+    workers = os.cpu_count() or 1
+    if workers >= PARALLEL_MIN_WORKERS and len(text) >= PARALLEL_MIN_CHARS:
+        return _convert_keymap_text_parallel(text, binding_re, jp_by_us, workers)
+    return _convert_keymap_text_serial(text, binding_re, jp_by_us)
+
+
+def _convert_keymap_text_serial(
+    data: bytes, binding_re: Pattern[bytes], jp_by_us: Dict[bytes, bytes]
+) -> Tuple[bytes, int]:
+    """Convert key names in a whole keymap in one regex pass"""
+    changed_lines = 0
+    pieces: List[bytes] = []
+    last = 0
+
+    for m in binding_re.finditer(data):
+        key_group = m.lastindex
+        if key_group is None:
+            continue  # leave bindings that need no conversion untouched
+
+        # Splice in the new name; everything between conversions is copied as-is
+        start, end = m.span(key_group)
+        # Conversions come in order, so this one starts a new changed line iff
+        # it is the first or a newline separates it from the previous one.
+        if not pieces or data.find(b"\n", last, start) >= 0:
+            changed_lines += 1
+        pieces.append(data[last:start])
+        pieces.append(jp_by_us[m.group(key_group)])
+        last = end
+
+    pieces.append(data[last:])
+    return b"".join(pieces), changed_lines
+
+
+def _convert_keymap_text_parallel(
+    data: bytes, binding_re: Pattern[bytes], jp_by_us: Dict[bytes, bytes], workers: int
+) -> Tuple[bytes, int]:
+    """Convert key names chunk by chunk across worker processes"""
+    # Imported here: concurrent.futures pulls in logging and more, which would
+    # roughly double start-up for the usual keymap that never gets this far
+    import concurrent.futures
+    import itertools
+
+    # Bindings never span lines, so chunks cut just after a newline convert
+    # independently and their line counts simply add up.
+    chunk_size = -(-len(data) // workers)
+    chunks: List[bytes] = []
+    start = 0
+    while start < len(data):
+        end = data.find(b"\n", start + chunk_size)
+        end = len(data) if end < 0 else end + 1
+        chunks.append(data[start:end])
+        start = end
+
+    # Free-threaded builds (3.13+) can share the chunks without pickling them
+    executor: concurrent.futures.Executor
+    if getattr(sys, "_is_gil_enabled", lambda: True)():
+        executor = concurrent.futures.ProcessPoolExecutor(workers)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+    with executor:
+        results = list(
+            executor.map(
+                _convert_keymap_text_serial,
+                chunks,
+                itertools.repeat(binding_re),
+                itertools.repeat(jp_by_us),
+            )
+        )
+
+    return b"".join(chunk for chunk, _ in results), sum(count for _, count in results)
+
+
+def read_keymap(fd: int, size: int) -> bytes:
+    """Read a keymap's raw bytes from an open descriptor whose fstat size is known"""
+    # Asking for one byte more than fstat reported normally gets the whole file
+    # and confirms EOF in a single read; keep reading only if it grew meanwhile
+    data = os.read(fd, size + 1)
+    if len(data) <= size:
+        return data
+    chunks = [data]
+    while True:
+        chunk = os.read(fd, 1 << 20)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
 
 
 def convert_file(input_path: str) -> None:
     """Convert keymap file from US to JIS layout aliases"""
-    input_file = Path(input_path)
-
-    if not input_file.exists():
-        print(f"Error: File '{input_path}' not found", file=sys.stderr)
+    if convert_files([input_path]):
         sys.exit(1)
 
+
+def convert_files(input_paths: List[str]) -> int:
+    """
+    Convert several keymap files, building the shared conversion state once.
+
+    A file that fails is reported and skipped; returns how many failed.
+    """
+    conversion_map = create_conversion_map()
+    header = generate_define_header_bytes()
+    failures = 0
+    for input_path in input_paths:
+        if not _convert_one(input_path, conversion_map, header):
+            failures += 1
+    return failures
+
+
+def _create_backup(input_file: Path, backup_file: Path, raw: bytes, st: os.stat_result) -> None:
+    """Back up input_file, preferably as a hard link to its current contents"""
+    # The input is later swapped out with os.replace rather than rewritten, so a
+    # hard link keeps the original inode as the backup without copying any data.
+    try:
+        try:
+            backup_file.unlink()
+        except FileNotFoundError:
+            pass
+        os.link(input_file.resolve(), backup_file)
+        return
+    except OSError:
+        pass  # e.g. FAT/exFAT or a cross-device symlink target
+
+    # Same content, mode and timestamps as shutil.copy2, without rereading the input
+    with open(backup_file, "wb") as f:
+        f.write(raw)
+    os.chmod(backup_file, stat.S_IMODE(st.st_mode))
+    os.utime(backup_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def _replace_keymap(input_file: Path, pieces: List[bytes], st: os.stat_result) -> None:
+    """Write pieces to a temporary file and atomically move it over input_file"""
+    target = input_file.resolve()  # replace a symlink's target, not the link
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{target.name}.", suffix=".tmp", dir=target.parent)
+    try:
+        # Write the pieces straight out instead of concatenating them first
+        with open(fd, "wb", buffering=1 << 20) as f:
+            for piece in pieces:
+                f.write(piece)
+        # Keep the keymap's owner and group where allowed (before chmod, as
+        # chown may clear set-id bits; there is no os.chown on Windows)
+        if hasattr(os, "chown"):
+            try:
+                os.chown(tmp_path, st.st_uid, st.st_gid)
+            except PermissionError:
+                pass
+        os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+        # Extended attributes (Linux only) are copied on a best-effort basis too
+        if hasattr(os, "listxattr"):
+            try:
+                names = os.listxattr(target)
+            except OSError:
+                names = []
+            for name in names:
+                try:
+                    os.setxattr(tmp_path, name, os.getxattr(target, name))
+                except OSError:
+                    pass  # e.g. security.* attributes we may not set
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _convert_one(input_path: str, conversion_map: Dict[str, str], header: bytes) -> bool:
+    """Convert one keymap file using prebuilt conversion state; returns whether it succeeded"""
+    input_file = Path(input_path)
     backup_file = Path(f"{input_path}_original")
 
+    # One open and one fstat serve the existence check, the read and the backup
     try:
-        shutil.copy2(input_file, backup_file)
-        print(f"Backup created: {backup_file}")
+        fd = os.open(input_file, os.O_RDONLY)
+    except FileNotFoundError:
+        print(f"Error: File '{input_path}' not found", file=sys.stderr)
+        return False
     except Exception as e:
-        print(f"Error creating backup: {e}", file=sys.stderr)
-        sys.exit(1)
+        print(f"Error reading file: {e}", file=sys.stderr)
+        return False
 
     try:
-        with open(input_file, "r", encoding="utf-8") as f:
-            lines = f.readlines()
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            raise OSError(f"'{input_path}' is not a regular file")
+        raw = read_keymap(fd, st.st_size)
     except Exception as e:
         print(f"Error reading file: {e}", file=sys.stderr)
-        sys.exit(1)
-
-    conversion_map = create_conversion_map()
-    converted_lines: List[str] = []
-    conversion_count = 0
-
-    for line in lines:
-        original_line = line
-        converted_line = convert_keymap_line(line, conversion_map)
-        converted_lines.append(converted_line)
-        if original_line != converted_line:
-            conversion_count += 1
+        return False
+    finally:
+        os.close(fd)
 
-    header = generate_define_header()
-    output_content = header + "\n" + "".join(converted_lines)
+    try:
+        _create_backup(input_file, backup_file, raw, st)
+        print(f"Backup created: {backup_file}")
+    except Exception as e:
+        print(f"Error creating backup: {e}", file=sys.stderr)
+        return False
+
+    # CRLF needs no folding: '\r' is a separator and never part of a key name,
+    # so only lone-CR line breaks are turned into LF, as a text-mode read would
+    data = raw
+    if b"\r" in raw and raw.count(b"\r") != raw.count(b"\r\n"):
+        data = re.sub(rb"\r(?!\n)", b"\n", raw)
+
+    converted_data, conversion_count = convert_keymap_text(data, conversion_map)
+    # The header follows the line ending of the keymap's first line
+    first_newline = data.find(b"\n")
+    if first_newline > 0 and data[first_newline - 1] == ord("\r"):
+        pieces = [header.replace(b"\n", b"\r\n"), b"\r\n", converted_data]
+    else:
+        pieces = [header, b"\n", converted_data]
 
     try:
-        with open(input_file, "w", encoding="utf-8") as f:
-            f.write(output_content)
+        _replace_keymap(input_file, pieces, st)
         print(f"Conversion completed: {input_file}")
         print(f"Lines converted: {conversion_count}")
         print(f"Total key definitions: {len(conversion_map)}")
         print(f"Target bindings: {', '.join(sorted(BINDING_KEY_ARG_RULES.keys()))}")
     except Exception as e:
         print(f"Error writing file: {e}", file=sys.stderr)
-        sys.exit(1)
+        return False
+    return True
 
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python convert_us_to_jis.py <input_keymap_file>")
+def main() -> None:
+    if len(sys.argv) < 2:
+        print("Usage: python convert_us_to_jis.py <input_keymap_file> [<input_keymap_file> ...]")
         print("\nExample:")
         print("  python convert_us_to_jis.py input.keymap")
-        print("\nThis will:")
+        print("\nThis will, for each file:")
         print("  - Backup: input.keymap -> input.keymap_original")
         print("  - Convert: input.keymap (overwritten with JIS layout aliases)")
         sys.exit(1)
 
-    convert_file(sys.argv[1])
+    if convert_files(sys.argv[1:]):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+"""Tests for convert_us_to_jis (run with: python -m unittest)"""
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import convert_us_to_jis as conv
+
+CONVERSION_MAP = conv.create_conversion_map()
+
+
+def convert(line: str) -> str:
+    return conv.convert_keymap_line(line, CONVERSION_MAP)
+
+
+class ConvertLineTest(unittest.TestCase):
+    def test_kp_converts_first_argument(self) -> None:
+        self.assertEqual(convert("&kp EQUAL"), "&kp JP_EQUAL")
+        self.assertEqual(convert("&kp EQUAL SEMI"), "&kp JP_EQUAL SEMI")
+        self.assertEqual(convert("&kp A EQUAL"), "&kp A EQUAL")
+
+    def test_mt_and_lt_convert_last_argument(self) -> None:
+        for binding in ("mt", "lt", "lt_to_layer_0"):
+            with self.subTest(binding=binding):
+                self.assertEqual(convert(f"&{binding} 1 EQUAL"), f"&{binding} 1 JP_EQUAL")
+                self.assertEqual(convert(f"&{binding} EQUAL A"), f"&{binding} EQUAL A")
+
+    def test_other_bindings_and_names_are_left_alone(self) -> None:
+        self.assertEqual(convert("&foo EQUAL"), "&foo EQUAL")
+        self.assertEqual(convert("&kpx EQUAL"), "&kpx EQUAL")
+        self.assertEqual(convert("&kp EQUALX"), "&kp EQUALX")
+        self.assertEqual(convert("&kp LS(EQUAL)"), "&kp LS(EQUAL)")
+
+    def test_binding_swallowed_by_preceding_match(self) -> None:
+        # A binding's arguments run up to the next ',', ';', '>' or newline
+        self.assertEqual(convert("&foo X &kp EQUAL"), "&foo X &kp EQUAL")
+        self.assertEqual(convert("&kp A &kp EQUAL"), "&kp A &kp EQUAL")
+        self.assertEqual(convert("&foo X, &kp EQUAL"), "&foo X, &kp JP_EQUAL")
+        self.assertEqual(convert("<&kp AT &kp EQUAL>"), "<&kp JP_AT &kp EQUAL>")
+
+    def test_spacing_is_kept_verbatim(self) -> None:
+        self.assertEqual(convert("&mt  LCTRL\tEQUAL  ;"), "&mt  LCTRL\tJP_EQUAL  ;")
+        self.assertEqual(convert("&kp\tAT  // at"), "&kp\tJP_AT  // at")
+
+    def test_unicode_whitespace_separates_arguments(self) -> None:
+        self.assertEqual(convert("&mt LCTRL\xa0EQUAL"), "&mt LCTRL\xa0JP_EQUAL")
+        self.assertEqual(convert("&kp\u3000EQUAL"), "&kp\u3000JP_EQUAL")
+        self.assertEqual(convert("&mt A\x85EQUAL"), "&mt A\x85JP_EQUAL")
+        self.assertEqual(convert("&kp EQUAL\u3001"), "&kp EQUAL\u3001")
+
+    def test_custom_conversion_map(self) -> None:
+        self.assertEqual(conv.convert_keymap_line("&kp A &kp B", {"A": "X"}), "&kp X &kp B")
+
+
+class ConvertTextTest(unittest.TestCase):
+    def test_counts_changed_lines(self) -> None:
+        text = "&kp AT, &kp EQUAL\n&kp A\n&mt 1 PIPE\n"
+        converted, count = conv.convert_keymap_text(text, CONVERSION_MAP)
+        self.assertEqual(converted, "&kp JP_AT, &kp JP_EQUAL\n&kp A\n&mt 1 JP_PIPE\n")
+        self.assertEqual(count, 2)
+
+    def test_bytes_that_are_not_utf8_pass_through(self) -> None:
+        converted, count = conv.convert_keymap_text(b"\xff&kp EQUAL\n", CONVERSION_MAP)
+        self.assertEqual(converted, b"\xff&kp JP_EQUAL\n")
+        self.assertEqual(count, 1)
+
+    def test_crlf_is_kept(self) -> None:
+        converted, count = conv.convert_keymap_text(b"&kp EQUAL\r\n&mt A AT\r\n", CONVERSION_MAP)
+        self.assertEqual(converted, b"&kp JP_EQUAL\r\n&mt A JP_AT\r\n")
+        self.assertEqual(count, 2)
+
+    def test_parallel_matches_serial(self) -> None:
+        data = b"&kp EQUAL &kp A\n&mt LSHIFT SEMI\n&lt 1 AT, &kp PIPE\n// &kp AT\n" * 500
+        binding_re, jp_by_us = conv._resolve_binding_re(CONVERSION_MAP)
+        serial = conv._convert_keymap_text_serial(data, binding_re, jp_by_us)
+        parallel = conv._convert_keymap_text_parallel(data, binding_re, jp_by_us, 3)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(serial[1], 1500)
+
+
+class ConvertFilesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+
+    def convert_files(self, *contents: bytes) -> int:
+        paths = []
+        for i, content in enumerate(contents):
+            path = self.dir / f"{i}.keymap"
+            path.write_bytes(content)
+            paths.append(str(path))
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return conv.convert_files(paths)
+
+    def output(self, i: int) -> bytes:
+        return (self.dir / f"{i}.keymap").read_bytes()
+
+    def test_writes_header_and_backup(self) -> None:
+        self.assertEqual(self.convert_files(b"&kp EQUAL\n"), 0)
+        header = conv.generate_define_header_bytes()
+        self.assertEqual(self.output(0), header + b"\n&kp JP_EQUAL\n")
+        self.assertEqual((self.dir / "0.keymap_original").read_bytes(), b"&kp EQUAL\n")
+
+    def test_line_endings(self) -> None:
+        header = conv.generate_define_header_bytes()
+        self.convert_files(
+            b"&kp EQUAL\r\n&kp AT\r\n",
+            b"&kp EQUAL\n&kp AT\r\n",
+            b"&kp EQUAL\r&kp AT\r",
+        )
+        crlf_header = header.replace(b"\n", b"\r\n") + b"\r\n"
+        self.assertEqual(self.output(0), crlf_header + b"&kp JP_EQUAL\r\n&kp JP_AT\r\n")
+        self.assertEqual(self.output(1), header + b"\n&kp JP_EQUAL\n&kp JP_AT\r\n")
+        self.assertEqual(self.output(2), header + b"\n&kp JP_EQUAL\n&kp JP_AT\n")
+
+    def test_failure_does_not_stop_the_batch(self) -> None:
+        missing = str(self.dir / "missing.keymap")
+        first = self.dir / "first.keymap"
+        first.write_bytes(b"&kp AT\n")
+        last = self.dir / "last.keymap"
+        last.write_bytes(b"&kp PIPE\n")
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            failures = conv.convert_files([str(first), missing, os.fspath(self.dir), str(last)])
+        self.assertEqual(failures, 2)
+        self.assertTrue(first.read_bytes().endswith(b"&kp JP_AT\n"))
+        self.assertTrue(last.read_bytes().endswith(b"&kp JP_PIPE\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()